@@ -1,3 +1,4 @@
+from operator import itemgetter
 from appdaemon.plugins.hass import Hass
 from common.decorators import log_call, handle_errors, debugpy_init
 
@@ -20,8 +21,8 @@ class BatteryMonitor(Hass):
         self.notify_service = config.get("notifier", "notify/notify")
         
         # Get custom binary sensor low battery states
-        self.binary_low_states = [state.lower() for state in config.get("binary_low_states", 
-            ["on", "low", "replace", "critical", "false"])]
+        self.binary_low_states = frozenset(state.lower() for state in config.get("binary_low_states", 
+            ["on", "low", "replace", "critical", "false"]))
 
         # Validate configuration
         self._validate_config()
@@ -51,39 +52,44 @@ class BatteryMonitor(Hass):
     def check_battery_levels(self, kwargs: dict[str, any]) -> None:
         """Check battery levels of all configured devices."""
         self.log("Checking battery levels for all devices", level="INFO")
+
+        # Fetch all states once and look up each battery entity in the snapshot
+        all_states = self.get_state(copy=False) # Read-only snapshot, no deep copy needed
         
-        low_battery_devices = []
-        low_battery_devices.extend(self._check_regular_sensors())
-        low_battery_devices.extend(self._check_binary_sensors())
+        sensors_low = self._check_regular_sensors(all_states) or []
+        binary_low = self._check_binary_sensors(all_states) or []
 
         # Send notifications if any devices have low battery
-        if low_battery_devices:
-            self.notify_low_batteries(low_battery_devices)
+        if sensors_low or binary_low:
+            self.notify_low_batteries(sensors_low, binary_low)
 
     @log_call
     @handle_errors(level="WARNING")
-    def _check_regular_sensors(self) -> list[dict[str, str]]:
+    def _check_regular_sensors(self, all_states: dict[str, dict]) -> list[dict[str, str]]:
         """Check battery levels of sensors that report percentage."""
         low_battery_devices = []
+        # Bind loop invariants to locals
+        threshold = self.battery_threshold
+        state_of = all_states.get
+        low_battery_devices_append = low_battery_devices.append
         
         for sensor in self.sensors:
             bat_entity = sensor.get("entity", {}).get("battery", None)
             if not bat_entity:
                 continue
 
-            battery_level = self.get_state(bat_entity)
+            battery_level = state_of(bat_entity, {}).get("state")
             if battery_level is None:
                 self.log(f"No battery state available for {bat_entity}", level="DEBUG")
                 continue
 
             try:
                 battery_level = float(battery_level)
-                if battery_level < self.battery_threshold:
+                if battery_level < threshold:
                     device_name = sensor.get("device", bat_entity)
-                    low_battery_devices.append({
+                    low_battery_devices_append({
                         "name": device_name,
-                        "level": f"{battery_level:.1f}%",
-                        "type": "sensor"
+                        "level": f"{battery_level:.1f}%"
                     })
             except (ValueError, TypeError):
                 self.log(f"Invalid battery level '{battery_level}' for {bat_entity}", level="WARNING")
@@ -93,52 +99,53 @@ class BatteryMonitor(Hass):
 
     @log_call
     @handle_errors(level="WARNING")
-    def _check_binary_sensors(self) -> list[dict[str, str]]:
+    def _check_binary_sensors(self, all_states: dict[str, dict]) -> list[dict[str, str]]:
         """Check battery state of binary sensors (like TRVs)."""
         low_battery_devices = []
+        # Bind loop invariants to locals
+        low_states = self.binary_low_states
+        state_of = all_states.get
+        low_battery_devices_append = low_battery_devices.append
         
         for sensor in self.binary_sensors:
             bat_entity = sensor.get("entity", {}).get("battery", None)
             if not bat_entity:
                 continue
 
-            battery_state = self.get_state(bat_entity)
+            battery_state = state_of(bat_entity, {}).get("state")
             if battery_state is None:
                 self.log(f"No battery state available for {bat_entity}", level="DEBUG")
                 continue
 
             # Check if current state indicates low battery
-            if str(battery_state).lower() in self.binary_low_states:
+            if str(battery_state).lower() in low_states:
                 device_name = sensor.get("device", bat_entity)
-                low_battery_devices.append({
+                low_battery_devices_append({
                     "name": device_name,
-                    "level": "LOW",
-                    "type": "binary_sensor"
+                    "level": "LOW"
                 })
 
         return low_battery_devices
 
     @handle_errors(level="ERROR")
-    def notify_low_batteries(self, low_battery_devices: list[dict[str, str]]) -> None:
+    def notify_low_batteries(self, sensors_low: list[dict[str, str]], binary_low: list[dict[str, str]]) -> None:
         """Send notification about devices with low batteries."""
-        if not low_battery_devices:
+        if not sensors_low and not binary_low:
             return
 
-        # Group devices by type for better readability
-        sensors = [d for d in low_battery_devices if d['type'] == 'sensor']
-        binary_sensors = [d for d in low_battery_devices if d['type'] == 'binary_sensor']
-        
-        # Build notification message
+        # Build notification message, grouped by device type for better readability
         message_parts = ["Devices needing battery replacement:"]
         
-        if sensors:
+        if sensors_low:
             message_parts.append("\nDevices with low battery level:")
-            for device in sorted(sensors, key=lambda x: x['name']):
+            sensors_low.sort(key=itemgetter('name'))
+            for device in sensors_low:
                 message_parts.append(f"- {device['name']}: {device['level']}")
                 
-        if binary_sensors:
+        if binary_low:
             message_parts.append("\nTRVs reporting battery warning:")
-            for device in sorted(binary_sensors, key=lambda x: x['name']):
+            binary_low.sort(key=itemgetter('name'))
+            for device in binary_low:
                 message_parts.append(f"- {device['name']}")
         
         message = '\n'.join(message_parts)
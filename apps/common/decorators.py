@@ -1,7 +1,8 @@
+import asyncio
 import functools
+import logging
 import time
-from typing import Callable, Type, TypeVar
-import debugpy
+from typing import Type, TypeVar
 
 T = TypeVar('T')
 
@@ -18,6 +19,8 @@ def debugpy_init(port: int = 5678):
         def wrapped_init(self, *args, **kwargs):
             # Only initialize debugpy for the first instance
             if not hasattr(cls, '_debugpy_initialized'):
+                # Imported here so apps that don't use the decorator never load debugpy
+                import debugpy
                 try:
                     debugpy.listen(("localhost", port))
                     debugpy.wait_for_client()
@@ -36,13 +39,34 @@ def debugpy_init(port: int = 5678):
     return decorator
 
 
+def _info_enabled(app) -> bool:
+    """True if INFO messages from the app would be emitted (see 'log_level' in apps.yaml)."""
+    logger = getattr(app, "logger", None)
+    return logger is None or logger.isEnabledFor(logging.INFO)
+
+
 def log_call(func):
     """Decorator to log entry and exit of a method."""
+    func_name = func.__name__
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, *args, **kwargs):
+            if not _info_enabled(self):
+                return await func(self, *args, **kwargs)
+            self.log(f"Calling '{func_name}'", level="INFO")
+            result = await func(self, *args, **kwargs)
+            self.log(f"Done '{func_name}'", level="INFO")
+            return result
+        return async_wrapper
+
     @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
-        self.log(f"Calling '{func.__name__}'", level="INFO")
+        if not _info_enabled(self):
+            return func(self, *args, **kwargs)
+        self.log(f"Calling '{func_name}'", level="INFO")
         result = func(self, *args, **kwargs)
-        self.log(f"Done '{func.__name__}'", level="INFO")
+        self.log(f"Done '{func_name}'", level="INFO")
         return result
     return wrapper
 
@@ -57,40 +81,99 @@ def requires_active_listener(func):
     return wrapper
 
 
-def handle_errors(*decorator_args, **decorator_kwargs):
+def active_and_logged(func):
+    """Decorator combining requires_active_listener and log_call in a single wrapper.
+
+    Calls made while the listener is suspended return immediately without logging.
+    """
+    func_name = func.__name__
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, *args, **kwargs):
+            if not getattr(self, "active", True):
+                return
+            if not _info_enabled(self):
+                return await func(self, *args, **kwargs)
+            self.log(f"Calling '{func_name}'", level="INFO")
+            result = await func(self, *args, **kwargs)
+            self.log(f"Done '{func_name}'", level="INFO")
+            return result
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if not getattr(self, "active", True):
+            return
+        if not _info_enabled(self):
+            return func(self, *args, **kwargs)
+        self.log(f"Calling '{func_name}'", level="INFO")
+        result = func(self, *args, **kwargs)
+        self.log(f"Done '{func_name}'", level="INFO")
+        return result
+    return wrapper
+
+
+def handle_errors(level: str = "ERROR", return_value=None):
     """Decorator to catch and log exceptions in app methods.
+
+    Always used with parentheses, e.g. @handle_errors() or @handle_errors(level="WARNING").
     
     Args:
-        *decorator_args: Variable positional arguments
-        **decorator_kwargs: Variable keyword arguments
-            level: Log level for errors (default: "ERROR")
-            return_value: Value to return on error (default: None)
+        level: Log level for errors (default: "ERROR")
+        return_value: Value to return on error (default: None)
     """
     def decorator(func):
+        func_name = func.__name__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                try:
+                    return await func(self, *args, **kwargs)
+                except Exception as e:
+                    self.log(f"Exception in '{func_name}': {e}", level=level)
+                    return return_value
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(self, *args, **kwargs):
             try:
                 return func(self, *args, **kwargs)
             except Exception as e:
-                level = decorator_kwargs.get('level', "ERROR")
-                return_value = decorator_kwargs.get('return_value', None)
-                self.log(f"Exception in '{func.__name__}': {e}", level=level)
+                self.log(f"Exception in '{func_name}': {e}", level=level)
                 return return_value
         return wrapper
-    
-    # Handle case where decorator is used without arguments
-    if len(decorator_args) == 1 and callable(decorator_args[0]):
-        return decorator(decorator_args[0])
     return decorator
 
 
+# Bare decorator with the default options
+handle_errors_default = handle_errors()
+
+
 def time_it(func):
     """Optional: log time taken by a method."""
+    func_name = func.__name__
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, *args, **kwargs):
+            if not _info_enabled(self):
+                return await func(self, *args, **kwargs)
+            start = time.perf_counter()
+            result = await func(self, *args, **kwargs)
+            elapsed = time.perf_counter() - start
+            self.log(f"'{func_name}' took {elapsed:.3f} seconds", level="INFO")
+            return result
+        return async_wrapper
+
     @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
-        start = time.time()
+        if not _info_enabled(self):
+            return func(self, *args, **kwargs)
+        start = time.perf_counter()
         result = func(self, *args, **kwargs)
-        elapsed = time.time() - start
-        self.log(f"'{func.__name__}' took {elapsed:.3f} seconds", level="INFO")
+        elapsed = time.perf_counter() - start
+        self.log(f"'{func_name}' took {elapsed:.3f} seconds", level="INFO")
         return result
     return wrapper
@@ -1,22 +1,67 @@
-from datetime import datetime, timedelta, timezone
-import requests
-import debugpy
-from appdaemon.adapi import ADAPI
+import asyncio
+import functools
+import time
+from datetime import date, datetime, timedelta, timezone
+import aiohttp
+import numpy as np
+try:
+    import orjson as json
+except ImportError:
+    import json
 from appdaemon.plugins.hass import Hass
 from common.decorators import log_call, handle_errors, time_it
 
+
+TOKEN_TTL_SECONDS = 3600
+
+# Sent with every request; json= payloads get their Content-Type from aiohttp
+DEFAULT_HEADERS = {"accept": "application/json", "api-version": "1.0"}
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_iso_date(iso_str):
+    """Parses an ISO 8601 string into a timezone-aware datetime object."""
+    # Handles both 'Z' and '+HH:MM' timezone formats, with or without microseconds
+    if iso_str[-1] == 'Z':
+        iso_str = iso_str[:-1] + '+00:00'
+    return datetime.fromisoformat(iso_str)
+
+
+def last_sum_before(stats, before):
+    """Returns the start and 'sum' of the latest statistic starting before the given time."""
+    last_start, last_sum = None, 0.0
+    for stat in stats:
+        start = parse_iso_date(stat['start'])
+        if start < before and stat.get('sum') is not None and (last_start is None or start > last_start):
+            last_start, last_sum = start, stat['sum']
+    return last_start, last_sum
+
+
+class RateLimitError(Exception):
+    """Raised when eloverblik rejects a request with HTTP 429."""
+
+
+class TokenExpiredError(Exception):
+    """Raised when eloverblik rejects the refresh token with HTTP 401."""
+
+
 class Energy(Hass):
 
     def initialize(self):
-        '''
-        debugpy.listen(("0.0.0.0", 5678))
-        self.log("debugpy listening on port 5678")
-        debugpy.wait_for_client()
-        '''
-
         self.log("Energy initialized")
         self.extract_config() 
         #self.hass = self.get_plugin_api("HASS")
+
+        # Shared HTTP session, created lazily on the event loop by _get_session()
+        self.session = None
+
+        # Refresh token cache, shared across runs and backfill days
+        self._token_cache = None
+        self._token_expiry = 0.0
+        self._token_lock = asyncio.Lock()
+
+        # Last hour imported by this app with its kWh and cost sums, see get_sum_offsets()
+        self._last_imported = None
         
         # New data is only available once pr. day @13:30('ish)
         self.run_daily(self.run_job, self.run_time)
@@ -35,29 +80,55 @@ class Energy(Hass):
         self.sensor_kwh     = config["sensor_kwh"]
         self.sensor_cost    = config["sensor_cost"]
         self.lookback_days  = config.get("lookback_days", 3) # Default to 3 days
+        self.verbose_log    = config.get("verbose_log", False) # Log every hour at DEBUG level
+
+    async def terminate(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    def _get_session(self):
+        """Returns the shared HTTP session, (re)creating it on first use inside the event loop."""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=8),
+                headers=DEFAULT_HEADERS
+            )
+        return self.session
 
     @log_call
     @handle_errors()
-    def run_job(self, kwargs):
+    async def run_job(self, kwargs):
         """Main job to find and process missing data days."""
-        missing_days = self.find_missing_stat_days()
+        missing_days = await self.find_missing_stat_days()
 
         if not missing_days: 
             self.log("No missing data found in the lookback period. All up to date.")
             return
 
-        self.log(f"Found {len(missing_days)} missing day(s) of data: {sorted(missing_days)}")
+        days = tuple(sorted(missing_days))
+        self.log(f"Found {len(days)} missing day(s) of data: {list(days)}")
 
         # Get a single token for all operations in this run
-        if not (token := self.get_refresh_token()):
+        if not (token := await self.get_refresh_token()):
             return
         
-        # Process each missing day 
-        for day in sorted(missing_days):
-            self.log(f"--- Processing data for missing day: {day.strftime('%Y-%m-%d')} ---")
-            if not self.process_single_day(day, token):
-                self.log(f"Failed to process data for {day}. Will retry on the next run.", level="WARNING")
-                # Stop processing further days if one fails, to avoid API rate limits
+        # Fetch all missing days concurrently
+        tasks = [self.process_single_day(day, token) for day in days]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Import the fetched days in date order
+        for day, details in zip(days, results):
+            if isinstance(details, RateLimitError):
+                self.log(f"{details}. Aborting current run. Will retry later.", level="WARNING")
+                break
+            if isinstance(details, Exception) or not details:
+                reason = f": {details}" if isinstance(details, Exception) else ""
+                self.log(f"Failed to process data for {day}{reason}. Will retry on the next run.", level="WARNING")
+                # Stop importing further days if one fails, to keep the statistics contiguous
+                break
+            self.log(f"--- Importing data for missing day: {day.strftime('%Y-%m-%d')} ---")
+            if not await self.prepare_data(details):
+                self.log(f"Failed to import data for {day}. Will retry on the next run.", level="WARNING")
                 break
 
     # def find_missing_stat_days(self):
@@ -83,13 +154,13 @@ class Energy(Hass):
     #     if history and history[0]:
     #         for state_change in history[0]:
     #             # The 'last_changed' timestamp is in UTC
-    #             dt_object = self.parse_iso_date(state_change['last_changed'])
+    #             dt_object = parse_iso_date(state_change['last_changed'])
     #             existing_dates.add(dt_object.date())
 
     #     missing_dates = expected_dates - existing_dates
     #     return missing_dates
 
-    def find_missing_stat_days(self): 
+    async def find_missing_stat_days(self): 
         """Queries HA statistics to find days with no data."""
         today = datetime.now(timezone.utc).date()
         start_date = today - timedelta(days=self.lookback_days)
@@ -103,7 +174,7 @@ class Energy(Hass):
             start_datetime = datetime.combine(start_date, datetime.min.time(), tzinfo=timezone.utc)
             end_datetime = datetime.combine(end_date, datetime.max.time(), tzinfo=timezone.utc)
             
-            response = self.call_service(
+            response = await self.call_service(
                 "recorder/get_statistics",
                 statistic_ids=[self.sensor_kwh],
                 start_time=start_datetime.isoformat(),
@@ -114,173 +185,240 @@ class Energy(Hass):
             
             # Extract statistics from response
             statistics = response.get(self.sensor_kwh, [])
-            self.log(statistics)
+            self.log(f"Found daily statistics for {len(statistics)} day(s) in the lookback period.", level="DEBUG")
             
         except Exception as e:
             self.log(f"Error fetching statistics from Home Assistant: {e}", level="ERROR")
             return set()
 
-        # Create a set of dates that already have data
-        existing_dates = set()
-        for stat in statistics:
-            # The 'start' timestamp represents the beginning of the period
-            dt_object = self.parse_iso_date(stat['start'])
-            existing_dates.add(dt_object.date())
+        # Create a set of dates that already have data; 'start' begins with the
+        # UTC "YYYY-MM-DD", so the date can be sliced out without a full ISO parse
+        existing_dates = {date.fromisoformat(stat['start'][:10]) for stat in statistics}
 
         missing_dates = expected_dates - existing_dates
         return missing_dates
 
-    def process_single_day(self, target_date, token):
-        """Fetches and processes data for a single day."""
+    async def process_single_day(self, target_date, token):
+        """Fetches consumption and cost details for a single day."""
         date_from = target_date.strftime("%Y-%m-%d")
         date_to = (target_date + timedelta(days=1)).strftime("%Y-%m-%d")
 
-        if not (consumption := self.get_consumption(token, date_from, date_to)):
-            return False
+        try:
+            consumption = await self.get_consumption(token, date_from, date_to)
+        except TokenExpiredError:
+            # Drop the rejected token and retry once with a fresh one
+            self.invalidate_token(token)
+            if not (token := await self.get_refresh_token()):
+                return None
+            consumption = await self.get_consumption(token, date_from, date_to)
+
+        if not consumption:
+            return None
         
-        return self.calculate_cost(consumption)
+        return await self.calculate_cost(consumption)
+
+    async def get_refresh_token(self):
+        """Returns the cached refresh token, fetching a new one once it has expired."""
+        async with self._token_lock:
+            if self._token_cache and time.monotonic() < self._token_expiry:
+                return self._token_cache
+
+            if token := await self.fetch_refresh_token():
+                self._token_cache = token
+                self._token_expiry = time.monotonic() + TOKEN_TTL_SECONDS
+            return token
+
+    def invalidate_token(self, token):
+        """Expires the cached token, unless it has already been replaced by a newer one."""
+        if token == self._token_cache:
+            self._token_expiry = 0.0
 
     @log_call
     @handle_errors()
-    def get_refresh_token(self):
+    async def fetch_refresh_token(self):
         url = "https://api.eloverblik.dk/customerapi/api/token"
-        headers = {
-            "accept": "application/json",
-            "api-version": "1.0",
-            "Authorization": f"Bearer {self.access_token}"
-        }
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            token = response.json().get("result")
-            self.log(f"Refresh token received: ****{token[-10:]}")
-            return token
-        elif response.status_code == 429:
-            # API is rate-limiting, so we stop the current job. It will retry on the next scheduled run.
-            self.log(f"Token error: {response.status_code} {response.text}. API rate limit hit. "
-                     f"Aborting current run. Will retry later.", level="WARNING")
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        async with self._get_session().get(url, headers=headers) as response:
+            if response.status == 200:
+                token = json.loads(await response.read()).get("result")
+                self.log(f"Refresh token received: ****{token[-10:]}")
+                return token
+            elif response.status == 429:
+                # API is rate-limiting, so we stop the current job. It will retry on the next scheduled run.
+                self.log(f"Token error: {response.status} {await response.text()}. API rate limit hit. "
+                         f"Aborting current run. Will retry later.", level="WARNING")
+                return None
+            self.log(f"Token error: {response.status} {await response.text()}", level="ERROR")
             return None
-        self.log(f"Token error: {response.status_code} {response.text}", level="ERROR")
-        return None
 
+    # Not wrapped in handle_errors: failures must propagate to the gather in run_job
     @log_call
-    @handle_errors()
-    def get_consumption(self, token, date_from, date_to):
+    async def get_consumption(self, token, date_from, date_to):
         url = f"https://api.eloverblik.dk/customerapi/api/meterdata/gettimeseries/{date_from}/{date_to}/{self.aggregation}"
-        headers = {
-            "Content-Type": "application/json",
-            "accept": "application/json",
-            "api-version": "1.0",
-            "Authorization": f"Bearer {token}"
-        }
+        headers = {"Authorization": f"Bearer {token}"}
         payload = {
             "meteringPoints": {"meteringPoint": [self.metering_point]}
         }
 
-        response = requests.post(url, json=payload, headers=headers)
-        if response.status_code != 200:
-            self.log(f"Failed to get consumption data for {date_from}: {response.status_code} {response.text}", level="WARNING")
-            return None
-
-        periods = response.json()["result"][0]["MyEnergyData_MarketDocument"]["TimeSeries"][0]["Period"]
-        return [
-            {
-                "date": (self.parse_iso_date(period["timeInterval"]["start"]) + timedelta(hours=i)).isoformat(),
-                "amount": float(point["out_Quantity.quantity"])
-            }
-            for period in periods
-            for i, point in enumerate(period["Point"])
-        ]
+        async with self._get_session().post(url, json=payload, headers=headers) as response:
+            if response.status == 401:
+                raise TokenExpiredError(f"Consumption error for {date_from}: {response.status} {await response.text()}")
+            if response.status == 429:
+                raise RateLimitError(f"Consumption error for {date_from}: {response.status} {await response.text()}. API rate limit hit")
+            if response.status != 200:
+                self.log(f"Failed to get consumption data for {date_from}: {response.status} {await response.text()}", level="WARNING")
+                return None
+            data = json.loads(await response.read())
+
+        periods = data["result"][0]["MyEnergyData_MarketDocument"]["TimeSeries"][0]["Period"]
+        result = []
+        for period in periods:
+            # The start is constant per period, so parse it once
+            base = parse_iso_date(period["timeInterval"]["start"])
+            result.extend(
+                {
+                    "date": (base + timedelta(hours=i)).isoformat(),
+                    "amount": float(point["out_Quantity.quantity"])
+                }
+                for i, point in enumerate(period["Point"])
+            )
+        return result
 
     @log_call
     @handle_errors()
     @time_it
-    def calculate_cost(self, consumption):
+    async def calculate_cost(self, consumption):
         url = "https://stromligning.dk/api/calculations/cost"
-        headers = {"Content-Type": "application/json", "accept": "application/json"}
         payload = {
             "productId": self.product_id,
             "supplierId": self.supplier_id,
             "consumption": consumption
         }
 
-        response = requests.post(url, json=payload, headers=headers)
-        if response.status_code != 200:
-            self.log(f"Cost API failed: {response.status_code} {response.text}", level="WARNING")
-            return False
+        async with self._get_session().post(url, json=payload) as response:
+            if response.status != 200:
+                self.log(f"Cost API failed: {response.status} {await response.text()}", level="WARNING")
+                return None
 
-        results = response.json().get("details", [])
-        return self.prepare_data(results)
+            return json.loads(await response.read()).get("details", [])
     
     
     @log_call
     @handle_errors()
     @time_it
-    def prepare_data(self, data):
+    async def prepare_data(self, data):
         total_payout = 0.0
+        total_kwh = 0.0
         breakdown = []
+        details = [] if self.verbose_log else None
 
         for entry in data:
-            date          = entry["date"]
+            hour_start    = entry["date"]
             kwh           = round(entry["amount"]["value"], 3)
             total         = round(entry["cost"]["total"], 2)
             unit_price    = round(float(total) / float(kwh), 6) if kwh else 0.0
             total_payout += total
+            total_kwh += kwh
             breakdown.append({
-                "date": date,
+                "date": hour_start,
                 "kwh": kwh,
                 "unit_price": unit_price,
                 "total": total
             })
-            self.log(f"{date} | kWh: {kwh:.3f} | Unit: {unit_price:.4f} DKK | Total: {total:.2f} DKK")
+            if details is not None:
+                details.append(f"{hour_start} | kWh: {kwh:.3f} | Unit: {unit_price:.4f} DKK | Total: {total:.2f} DKK")
+
+        if details:
+            self.log("\n".join(details), level="DEBUG")
+        self.log(f"Processed {len(breakdown)} hours, total kWh {total_kwh:.3f}, total cost {total_payout:.2f} DKK")
         
-        return self.send_statistics_to_ha(breakdown)
+        return await self.send_statistics_to_ha(breakdown)
     
+    async def get_sum_offsets(self, first_start, last_start):
+        """
+        Reads the hourly sums already in HA statistics around the hours to import.
+        Returns the set of hour starts that already exist and the kWh and cost sums
+        of the last hour before first_start, which the new cumulative sums continue from.
+        """
+        response = await self.call_service(
+            "recorder/get_statistics",
+            statistic_ids=[self.sensor_kwh, self.sensor_cost],
+            start_time=(first_start - timedelta(days=self.lookback_days)).isoformat(),
+            end_time=(last_start + timedelta(hours=1)).isoformat(),
+            period="hour",
+            types=["sum"]
+        )
+        kwh_stats  = response.get(self.sensor_kwh, [])
+        cost_stats = response.get(self.sensor_cost, [])
+
+        existing_hours = {parse_iso_date(stat['start']) for stat in kwh_stats}
+        kwh_start, last_sum_kwh = last_sum_before(kwh_stats, first_start)
+        _, last_sum_cost        = last_sum_before(cost_stats, first_start)
+
+        # The recorder imports asynchronously, so the previous day's import may not be readable yet
+        if self._last_imported:
+            imported_start, imported_kwh, imported_cost = self._last_imported
+            if imported_start < first_start and (kwh_start is None or imported_start > kwh_start):
+                last_sum_kwh, last_sum_cost = imported_kwh, imported_cost
+
+        return existing_hours, last_sum_kwh, last_sum_cost
+
     @log_call
     @handle_errors()
     @time_it
-    def send_statistics_to_ha(self, breakdown: list):
+    async def send_statistics_to_ha(self, breakdown: list):
         """
         Convert hourly breakdown into Home Assistant long-term statistics and send via recorder.import_statistics.
         Assumes sensors:
         - sensor.energy_kwh (state_class: total_increasing)
         - sensor.energy_cost (state_class: total)
         """
-        energy_stats = []
-        cost_stats = []
-
-        running_kwh = 0.0
-        running_cost = 0.0
-
-        for item in breakdown:
-            # Parse time to ISO format with timezone awareness
-            date_val = item["date"]
-            if isinstance(date_val, datetime):
-                start_time = date_val.isoformat()
-            else:
-                start_time = self.parse_iso_date(date_val).isoformat()
-            kwh         = item["kwh"]
-            cost        = item["total"]
-
-            running_kwh += kwh
-            running_cost += cost
-
-            energy_stats.append({
+        if not breakdown:
+            self.log("No statistics to send.", level="WARNING")
+            return False
+
+        # Parse each timestamp once; the cumulative sums are computed vectorised
+        starts   = [item["date"] if isinstance(item["date"], datetime) else parse_iso_date(item["date"])
+                    for item in breakdown]
+        existing_hours, last_sum_kwh, last_sum_cost = await self.get_sum_offsets(min(starts), max(starts))
+        kwh_arr  = np.fromiter((item["kwh"] for item in breakdown), dtype=np.float64, count=len(breakdown))
+        cost_arr = np.fromiter((item["total"] for item in breakdown), dtype=np.float64, count=len(breakdown))
+        sum_kwh  = (np.cumsum(kwh_arr) + last_sum_kwh).tolist()
+        sum_cost = (np.cumsum(cost_arr) + last_sum_cost).tolist()
+
+        # Hours already in HA keep counting towards the sums but are not re-imported
+        rows = [
+            (start_dt.isoformat(), item["kwh"], item["total"], running_kwh, running_cost)
+            for start_dt, item, running_kwh, running_cost in zip(starts, breakdown, sum_kwh, sum_cost)
+            if start_dt not in existing_hours
+        ]
+        if not rows:
+            self.log("All hours already exist in the statistics. Nothing to import.")
+            return True
+
+        energy_stats = [
+            {
                 "start": start_time,
                 "sum": running_kwh,     # cumulative total
                 "state": kwh,           # hourly consumption
                 "min": kwh,
                 "max": kwh,
                 "last_reset": None      # None = part of a continuous series
-            })
+            }
+            for start_time, kwh, _, running_kwh, _ in rows
+        ]
 
-            cost_stats.append({
+        cost_stats = [
+            {
                 "start": start_time,
                 "sum": running_cost,    # cumulative total cost
                 "state": cost,          # hourly cost
                 "min": cost,
                 "max": cost,
                 "last_reset": None
-            })
+            }
+            for start_time, _, cost, _, running_cost in rows
+        ]
 
         # Build the payloads per sensor
         payloads = []
@@ -311,20 +449,11 @@ class Energy(Hass):
             total_points = len(energy_stats) + len(cost_stats)
             self.log(f"Sending {total_points} statistics to Home Assistant...")
 
-            for payload in payloads:
-                self.call_service("recorder/import_statistics", **payload)
+            await asyncio.gather(*(self.call_service("recorder/import_statistics", **payload) for payload in payloads))
+            self._last_imported = (max(starts), sum_kwh[-1], sum_cost[-1])
 
             self.log("Statistics sent successfully.")
             return True
         else:
             self.log("No statistics to send.", level="WARNING")
-            return False
-
-
-    
-    def parse_iso_date(self, iso_str):
-        """Parses an ISO 8601 string into a timezone-aware datetime object."""
-        # Handles both 'Z' and '+HH:MM' timezone formats, with or without microseconds
-        if iso_str.endswith('Z'):
-            iso_str = iso_str[:-1] + '+00:00'
-        return datetime.fromisoformat(iso_str)
\ No newline at end of file
+            return False
\ No newline at end of file
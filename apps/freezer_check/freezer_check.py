@@ -1,9 +1,7 @@
-from datetime import datetime, timedelta
 from appdaemon.adapi import ADAPI
 from common.decorators import log_call
 from collections import deque
 from typing import Deque
-import debugpy
 
 
 class FreezerCheck(ADAPI):
@@ -29,8 +27,15 @@ class FreezerCheck(ADAPI):
         self.log("----- Initializing FreezerCheck App -----")
         self.extract_config()
 
+        # Number of timed power samples averaged per check
         self.num_data_points = int(self.check_interval_minutes / self.sample_rate_minutes)
         self.power_samples: Deque[float] = deque(maxlen=self.num_data_points)
+        self._sum = 0.0 # Running sum of power_samples
+
+        # Cache the latest reading on every change, so the timed sampler doesn't query the state.
+        # A plug holding a constant value sends no events, so the samples themselves stay time-based.
+        self._latest_power = self.get_state(self.smartplug_power)
+        self.listen_state(self.on_power_change, self.smartplug_power)
 
         # Start sampling and checking right away for faster feedback after restarts.
         self.log(f"Sampling power every {self.sample_rate_minutes} minutes.")
@@ -40,12 +45,20 @@ class FreezerCheck(ADAPI):
         self.log(f"Checking average power every {self.check_interval_minutes} minutes.")
         self.run_in(self.schedule_recurring_check, self.check_interval_minutes * 60)
 
+    def on_power_change(self, entity, attribute, old, new, **kwargs):
+        """Callback to cache the power reading whenever the smartplug reports a new value."""
+        self._latest_power = new
+
     @log_call
     def on_power_usage_sample(self, **kwargs):
-        """Callback to sample the current power usage from the smartplug."""
+        """Callback to sample the latest power usage of the smartplug."""
         try:
-            power_usage = float(self.get_state(self.smartplug_power))
+            power_usage = float(self._latest_power)
+            # The deque evicts the oldest sample when full; keep the running sum in step
+            if len(self.power_samples) == self.num_data_points:
+                self._sum -= self.power_samples[0]
             self.power_samples.append(power_usage)
+            self._sum += power_usage
             self.log(f"[Sample] Current: {power_usage}W")  
 
         except (ValueError, TypeError) as e:
@@ -64,7 +77,7 @@ class FreezerCheck(ADAPI):
                      f"Expected {self.num_data_points} samples, got {len(self.power_samples)}.")
             return
 
-        avg_power = sum(self.power_samples) / self.num_data_points
+        avg_power = self._sum / self.num_data_points
         self.log(f"[Check] Average power over last {self.check_interval_minutes} mins: {avg_power:.2f}W. "
                  f"Thresholds: min={self.alert_power_min}W, max={self.alert_power_max}W.")
 
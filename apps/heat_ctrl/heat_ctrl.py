@@ -1,131 +1,273 @@
+import asyncio
+import time
+from bisect import bisect_right
+from collections import namedtuple
+from dataclasses import dataclass, field
 from appdaemon.adapi import ADAPI
-from functools import wraps
-from common.decorators import log_call, requires_active_listener, debugpy_init
+from common.decorators import log_call, active_and_logged
+
+# Identical failure notifications (same location and setpoint) are sent at most once per this many seconds
+NOTIFY_DEBOUNCE_SEC = 3600
+
+# Seconds from writing the TRVs to the first verification; retries back off exponentially up to the max
+VERIFY_DELAY_SEC = 8
+VERIFY_DELAY_MAX_SEC = 60
+
+_WEEKDAY_IDX = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
+
+# One pre-parsed period entry from apps.yaml; wrap is True for ranges like "sat_tue".
+# setpoint and its tolerance bounds (lower, upper) are stored as floats.
+Rule = namedtuple("Rule", "period_name start end setpoint lower upper start_idx end_idx wrap")
+
+
+@dataclass(slots=True)
+class HeatCtrlConfig:
+    """Settings read from apps.yaml by HeatControl.extract_config."""
+    periods: dict = field(default_factory=dict)
+    location: str = ""
+    max_retries: int = 3
+    setpoint_on: float = 24.0
+    setpoint_off: float = 6.0
+    temp_tol_min: float = 0.5
+    temp_tol_max: float = 0.5
+    notifier: str = "notify/notify"
+    debug: bool = False                 # Log control_trv diagnostics
+    trv_pacing: float = 0.0             # Seconds between TRV writes, 0 = set all TRVs in one call
+    temp_sensor: str | None = None
+    window_sensor: str | None = None
+    trv_configs: tuple[dict, ...] = ()  # {"entity_id": ..., "attr": ...} per TRV
+
+
+def _to_seconds(time_str: str) -> int | None:
+    """
+    Converts "HH:MM:SS" (or "HH:MM") to seconds since midnight.
+    Returns None for other formats now_is_between understands, e.g. "sunset - 00:30:00".
+    """
+    try:
+        parts = [int(p) for p in time_str.split(":")]
+        return parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) > 2 else 0)
+    except (ValueError, IndexError):
+        return None
 
 
-#@debugpy_init(port=5678)
 class HeatControl(ADAPI):
 
+    # Parsed day ranges, e.g. "tue_fri" -> (1, 4). Shared by all instances as the ranges only depend on the string
+    _range_cache: dict[str, tuple[int, int]] = {}
+
     def extract_config(self):
         # Extract configs from apps.yaml
-        config = self.args       
-        self.periods      = config.get("periods",{})
-        self.location     = config.get("location", {})
-        self.retry_count  = config.get("retry_count", 3)
-        self.max_retries  = config.get("max_retries", 3)
-        self.setpoint_on  = float(config.get("TRV_setpoint_on", 24.0))
-        self.setpoint_off = float(config.get("TRV_setpoint_off", 6.0))
-        self.temp_tol_min = float(config.get("temperature_tollerance_min", 0.5))
-        self.temp_tol_max = float(config.get("temperature_tollerance_min", 0.5))        
-        self.notifier     = config.get("notifier", "notify/notify")
-
-        # Extract entities from apps.yaml
-        self.temp_sensor   = config.get("meter_temperature", {}).get("entity", {}).get("temperature")
-        self.window_sensor = config.get("window_sensor", {}).get("entity", {}).get("window_sensor")
-        
-        # Handle multiple TRVs
-        self.trv_configs = []        
-        for trv in config["trvs"]:
-            self.trv_configs.append({
+        config = self.args
+
+        # Handle multiple TRVs; the legacy single "trv:" key is treated as a list of one
+        trvs = [config["trv"]] if "trv" in config else config["trvs"]
+
+        self.cfg = HeatCtrlConfig(
+            periods       = config.get("periods", {}),
+            location      = config.get("location", ""),
+            max_retries   = config.get("max_retries", 3),
+            setpoint_on   = float(config.get("TRV_setpoint_on", 24.0)),
+            setpoint_off  = float(config.get("TRV_setpoint_off", 6.0)),
+            # Heat turns on below target - temp_tol_min and off above target + temp_tol_max.
+            # Both the "tolerance" and the legacy "tollerance" spelling are accepted.
+            temp_tol_min  = float(config.get("temperature_tolerance_min", config.get("temperature_tollerance_min", 0.5))),
+            temp_tol_max  = float(config.get("temperature_tolerance_max", config.get("temperature_tollerance_max", 0.5))),
+            notifier      = config.get("notifier", "notify/notify"),
+            debug         = bool(config.get("debug", False)),
+            trv_pacing    = float(config.get("trv_pacing_seconds", 0)),
+            # Extract entities from apps.yaml
+            temp_sensor   = config.get("meter_temperature", {}).get("entity", {}).get("temperature"),
+            window_sensor = config.get("window_sensor", {}).get("entity", {}).get("window_sensor"),
+            trv_configs   = tuple({
                 "entity_id": trv["entities"]["trv"]["entity_id"],
                 "attr": trv["entities"]["trv"]["attr"]["temperature"]
-            })
-       
-    
+            } for trv in trvs),
+        )
+        self.retry_count = config.get("retry_count", 3)
+
+        # Derived lookups
+        self._valid_setpoints = frozenset((self.cfg.setpoint_on, self.cfg.setpoint_off))
+        self._schedule        = self.build_schedule(self.cfg.periods)
+        self._by_day          = self.build_day_index(self._schedule)
+        # (entity_id, attr) per TRV, without duplicates from repeated includes
+        self._trv_pairs       = tuple(dict.fromkeys((trv["entity_id"], trv["attr"]) for trv in self.cfg.trv_configs))
+        self._trv_entity_ids  = list(dict.fromkeys(entity_id for entity_id, _ in self._trv_pairs))
+
     def initialize(self):
         
         self.extract_config() 
             
-        self.log(f"----- Initializing HeatControl for {self.location.upper()} -----") 
+        self.log(f"----- Initializing HeatControl for {self.cfg.location.upper()} -----") 
+
+        # State control, set before subscribing so callbacks never see a half-initialized app
+        self.active = True
+        self._today_cache = (None, None) # (date, weekday) of the last temperature event
+        self._last_trv_setpoint = None   # Last observed TRV setpoint as float, None when unknown
+        self._last_notify = (None, 0.0)  # ((location, setpoint), monotonic time) of the last failure notification
 
         # Subscribe to events
-        self.log(f"Subscribing to temp sensor: {self.temp_sensor}")
-        self.listen_state(self.on_temperature_change, entity_id=self.temp_sensor)
+        self.log(f"Subscribing to temp sensor: {self.cfg.temp_sensor}")
+        self.listen_state(self.on_temperature_change, entity_id=self.cfg.temp_sensor)
 
-        if self.window_sensor:
-            self.log(f"Subscribing to window sensor: {self.window_sensor}")
-            self.listen_state(self.on_window_change, entity_id=self.window_sensor)
+        if self.cfg.window_sensor:
+            self.log(f"Subscribing to window sensor: {self.cfg.window_sensor}")
+            self.listen_state(self.on_window_change, entity_id=self.cfg.window_sensor)
 
         # Subscribe to all TRVs
-        for trv in self.trv_configs:
-            self.log(f"Subscribing to TRV: {trv['entity_id']}")
+        for entity_id, attr in self._trv_pairs:
+            self.log(f"Subscribing to TRV: {entity_id}")
             self.listen_state(self.on_trv_setpoint_change,
-                            entity_id=trv['entity_id'],
-                            attribute=trv['attr'])
-
-    # State control
-        self.active = True
+                            entity_id=entity_id,
+                            attribute=attr)
 
 
     def activate_listener(self):
         self.active = True
-        self.log(f"LISTENER ACTIVATED")
+        self.log("LISTENER ACTIVATED")
 
     def suspend_listener(self):
         self.active = False
-        self.log(f"LISTENER SUSPENDED")
+        self.log("LISTENER SUSPENDED")
 
 
-    @requires_active_listener
-    @log_call
+    @active_and_logged
     def on_trv_setpoint_change(self, entity, attribute, old, new, **kwargs):
-        if float(new) not in [self.setpoint_on, self.setpoint_off]:
-            self.log(f"[OK] Manual override detected (new setpoint: {new}). Reverting...")
+        new_setpoint = float(new)
+        self._last_trv_setpoint = new_setpoint
+        if new_setpoint not in self._valid_setpoints:
+            self.log("[OK] Manual override detected (new setpoint: %s). Reverting...", new)
             self.suspend_listener()
 
-            if float(old) in [self.setpoint_on, self.setpoint_off]:
-                self.set_trv_setpoint(old)
+            old_setpoint = float(old)
+            if old_setpoint in self._valid_setpoints:
+                self.set_trv_setpoint(old_setpoint)
             else:
-                self.log(f"[ERROR] Unrecognized previous value: {old}. Turning TRV OFF.")
-                self.set_trv_setpoint(self.setpoint_off)
+                self.log("[ERROR] Unrecognized previous value: %s. Turning TRV OFF.", old)
+                self.set_trv_setpoint(self.cfg.setpoint_off)
     
-    @requires_active_listener
-    @log_call
+    @active_and_logged
     def on_temperature_change(self, entity, attribute, old, new, **kwargs):
         if new != "unavailable":
+            # Attribute-only updates carry the same value; nothing to re-evaluate
+            if new == old:
+                return
+
+            now = self.get_now()
+            if now.date() != self._today_cache[0]:
+                self._today_cache = (now.date(), now.strftime("%a").lower())
+            today = self._today_cache[1]
+            today_idx = _WEEKDAY_IDX[today]
             
-            today = self.get_now().strftime("%a").lower() 
-            
-            period_found = False
-            for period_name, entries in self.periods.items():
-                if self.is_day_in_range(period_name, today):
-                    for entry in entries:
-                        start, end, setpoint = entry.split(",")
-                        if self.now_is_between(start, end):
-                            self.log(f"[OK] Matched period: {period_name},{start},{end}, setpoint: {setpoint}")
-                            self.suspend_listener()
-                            self.control_trv(setpoint, new)
-                            return
-                    period_found = True
-
-            if not period_found:
-                self.log(f"No matching period found for today ({today})")
-                self.log(f"Check apps.yaml if period_temperature is defined for this moment")
+            starts, max_ends, windows, fallback = self._by_day[today_idx]
+            if windows or fallback:
+                now_s = now.hour * 3600 + now.minute * 60 + now.second
+                # Latest window starting at or before now; walk back only while an earlier window could still cover now
+                i = bisect_right(starts, now_s) - 1
+                while i >= 0 and max_ends[i] >= now_s:
+                    _, end_s, rule = windows[i]
+                    if now_s <= end_s:
+                        break
+                    i -= 1
+                else:
+                    # Rules with times like "sunrise" are left to AppDaemon
+                    rule = next((r for r in fallback if self.now_is_between(r.start, r.end)), None)
+
+                if rule is not None:
+                    self.log("[OK] Matched period: %s,%s,%s, setpoint: %s",
+                             rule.period_name, rule.start, rule.end, rule.setpoint)
+                    self.suspend_listener()
+                    self.control_trv(rule.setpoint, new, rule.lower, rule.upper)
+            else:
+                self.log("No matching period found for today (%s)", today)
+                self.log("Check apps.yaml if period_temperature is defined for this moment")
         else:
-            self.log(f"The {entity} is {new}")
+            self.log("The %s is %s", entity, new)
+
+    def build_schedule(self, periods: dict) -> list[Rule]:
+        """
+        Flattens the periods from apps.yaml into a list of pre-parsed rules, so
+        on_temperature_change doesn't split strings or resolve day names per event.
+        """
+        schedule = []
+        for period_name, entries in periods.items():
+            day_indices = self.parse_day_range(period_name)
+            if day_indices is None:
+                continue
+            start_index, end_index = day_indices
+            for entry in entries:
+                start, end, setpoint = entry.split(",")
+                setpoint = float(setpoint)
+                schedule.append(Rule(period_name, start, end, setpoint,
+                                     setpoint - self.cfg.temp_tol_min, setpoint + self.cfg.temp_tol_max,
+                                     start_index, end_index, start_index > end_index))
+        return schedule
+
+    def build_day_index(self, schedule: list[Rule]) -> list[tuple[list[int], list[int], list[tuple], list[Rule]]]:
+        """
+        Indexes the rules per weekday as time windows (start_s, end_s, rule) sorted by start,
+        together with the start seconds for bisect and a running max of the end seconds.
+        Rules that pass midnight (e.g. 22:00-02:00) become two windows on the same day.
+        Rules whose times aren't clock times (e.g. "sunrise") are kept as a per-day fallback list.
+        """
+        by_day = [[] for _ in range(7)]
+        fallback = [[] for _ in range(7)]
+        for rule in schedule:
+            if rule.wrap:
+                days = [*range(rule.start_idx, 7), *range(0, rule.end_idx + 1)]
+            else:
+                days = range(rule.start_idx, rule.end_idx + 1)
+
+            start_s, end_s = _to_seconds(rule.start), _to_seconds(rule.end)
+            if start_s is None or end_s is None:
+                for day in days:
+                    fallback[day].append(rule)
+                continue
+            if end_s < start_s:
+                windows = [(start_s, 86399, rule), (0, end_s, rule)]
+            else:
+                windows = [(start_s, end_s, rule)]
+
+            for day in days:
+                by_day[day].extend(windows)
+
+        index = []
+        for windows, day_fallback in zip(by_day, fallback):
+            windows.sort(key=lambda w: w[0])
+            max_ends, max_end = [], -1
+            for _, end_s, _ in windows:
+                max_end = max(max_end, end_s)
+                max_ends.append(max_end)
+            index.append(([w[0] for w in windows], max_ends, windows, day_fallback))
+        return index
+
+    def parse_day_range(self, day_range: str) -> tuple[int, int] | None:
+        """Resolves a day range (e.g., "mon" or "tue_fri") to its start and end weekday indices."""
+        day_indices = self._range_cache.get(day_range)
+        if day_indices is None:
+            parts = day_range.split('_')
+            start_index, end_index = _WEEKDAY_IDX.get(parts[0], -1), _WEEKDAY_IDX.get(parts[-1], -1)
+            if start_index < 0 or end_index < 0:
+                self.log(f"Invalid day range '{day_range}' in config.", level="WARNING")
+                return None
+            day_indices = self._range_cache[day_range] = (start_index, end_index)
+        return day_indices
 
     def is_day_in_range(self, day_range: str, current_day: str) -> bool:
         """
         Checks if a given day falls within a specified day range (e.g., "mon" or "tue_fri").
         Handles weekday ranges that wrap around the end of the week (e.g., "sat_mon").
         """
-        weekdays = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
-        
-        try:
-            current_day_index = weekdays.index(current_day)
-        except ValueError:
+        current_day_index = _WEEKDAY_IDX.get(current_day, -1)
+        if current_day_index < 0:
             self.log(f"Invalid current_day '{current_day}' provided.", level="WARNING")
             return False
 
-        parts = day_range.split('_')
-        start_day, end_day = parts[0], parts[-1]
-
-        try:
-            start_index, end_index = weekdays.index(start_day), weekdays.index(end_day)
-        except ValueError:
-            self.log(f"Invalid day range '{day_range}' in config.", level="WARNING")
+        day_indices = self.parse_day_range(day_range)
+        if day_indices is None:
             return False
 
+        start_index, end_index = day_indices
+
         if start_index <= end_index:
             # Standard range, e.g., mon_fri
             return start_index <= current_day_index <= end_index
@@ -133,109 +275,140 @@ class HeatControl(ADAPI):
             # Wraparound range, e.g., sat_tue
             return current_day_index >= start_index or current_day_index <= end_index
 
-    @requires_active_listener
-    @log_call
+    @active_and_logged
     def on_window_change(self, entity, attribute, old, new, **kwargs):
         """Callback for when the window sensor state changes."""
         if new == "on":  # Window is open
-            self.log(f"[INFO] Window opened in {self.location}. Turning TRV off.")
+            self.log("[INFO] Window opened in %s. Turning TRV off.", self.cfg.location)
             self.suspend_listener()
-            self.set_trv_setpoint(self.setpoint_off)
+            self.set_trv_setpoint(self.cfg.setpoint_off)
         elif new == "off":  # Window is closed
-            self.log(f"[INFO] Window closed in {self.location}. Resuming normal control.")
+            self.log("[INFO] Window closed in %s. Resuming normal control.", self.cfg.location)
         else:
-            self.log(f"[WARNING] Unknown window state: {new}")
+            self.log("[WARNING] Unknown window state: %s", new)
 
 
     @log_call
-    def control_trv(self, target_temp: str, current_temp: str, **kwargs):
-        current_setpoint = float(self.get_trv_setpoint())       
-        target_temp = float(target_temp)        
-        current_temp = float(current_temp)        
+    def control_trv(self, target_temp: float, current_temp: str,
+                    lower_bound: float | None = None, upper_bound: float | None = None, **kwargs):
+        current_setpoint = self.get_trv_setpoint()
+        current_temp = float(current_temp)
 
-        lower_bound = target_temp - self.temp_tol_min
-        upper_bound = target_temp + self.temp_tol_max
+        # Bounds come precomputed from the schedule rule
+        if lower_bound is None or upper_bound is None:
+            target_temp = float(target_temp)
+            lower_bound = target_temp - self.cfg.temp_tol_min
+            upper_bound = target_temp + self.cfg.temp_tol_max
 
-        self.log(f"{current_setpoint=} | {target_temp=} | {current_temp=} | {lower_bound=} | {upper_bound=}")
+        if self.cfg.debug:
+            self.log("current_setpoint=%s | target_temp=%s | current_temp=%s | lower_bound=%s | upper_bound=%s",
+                     current_setpoint, target_temp, current_temp, lower_bound, upper_bound)
 
 
         # Check window state before turning on the heat
-        if self.window_sensor and self.get_state(self.window_sensor) == "on":
+        if self.cfg.window_sensor and self.get_state(self.cfg.window_sensor) == "on":
             self.log("[INFO] Window is open. TRV will remain off.")            
-            if current_setpoint != self.setpoint_off:
-                self.set_trv_setpoint(self.setpoint_off)
+            if current_setpoint != self.cfg.setpoint_off:
+                self.set_trv_setpoint(self.cfg.setpoint_off)
             else:
                 self.activate_listener()
                 return
 
-        if current_setpoint in [self.setpoint_on, self.setpoint_off]:
-            if current_temp < lower_bound and current_setpoint != self.setpoint_on:
-                self.set_trv_setpoint(self.setpoint_on)
-            elif current_temp > upper_bound and current_setpoint != self.setpoint_off:
-                self.set_trv_setpoint(self.setpoint_off)
+        if current_setpoint in self._valid_setpoints:
+            if current_temp < lower_bound and current_setpoint != self.cfg.setpoint_on:
+                self.set_trv_setpoint(self.cfg.setpoint_on)
+            elif current_temp > upper_bound and current_setpoint != self.cfg.setpoint_off:
+                self.set_trv_setpoint(self.cfg.setpoint_off)
             else:
-                self.log(f"[OK] No action: Current TRV setpoint {current_setpoint}C is fine.")
+                self.log("[OK] No action: Current TRV setpoint %sC is fine.", current_setpoint)
                 self.activate_listener()
         else:
-            self.log(f"[ERROR] TRV is at unknown state {current_setpoint}C. No action taken.")
+            self.log("[ERROR] TRV is at unknown state %sC. No action taken.", current_setpoint)
             self.activate_listener()
 
    
     @log_call
     def set_trv_setpoint(self, setpoint: float, **kwargs):
         if not self.active:
-            self.log(f"Setting TRV setpoints to {setpoint}C...")
+            self.log("Setting TRV setpoints to %sC...", setpoint)
             self.retry_count = 0
             self.expected_setpoint = float(setpoint)
+            self._last_trv_setpoint = None # Unknown until verified
             
-            # Set temperature for all TRVs
-            for i, trv in enumerate(self.trv_configs):
+            if self.cfg.trv_pacing > 0:
+                # Pace the writes so each TRV is commanded at its own tick
+                for i, entity_id in enumerate(self._trv_entity_ids):
+                    self.run_in(self._write_one_trv, i * self.cfg.trv_pacing,
+                                entity_id=entity_id, temperature=self.expected_setpoint)
+                verify_delay = VERIFY_DELAY_SEC + (len(self._trv_entity_ids) - 1) * self.cfg.trv_pacing
+            else:
+                # Set temperature for all TRVs in a single service call
                 self.call_service("climate/set_temperature",
-                                entity_id=trv['entity_id'],
+                                entity_id=self._trv_entity_ids,
                                 temperature=self.expected_setpoint)
-                if i < len(self.trv_configs) - 1:  # Don't sleep after the last TRV
-                    self.run_in(lambda x: None, 1)  # Sleep for 1 second        
-            self.run_in(self.verify_trv_setpoint, 8)
+                verify_delay = VERIFY_DELAY_SEC
+            self.run_in(self.verify_trv_setpoint, verify_delay)
+
+    def _write_one_trv(self, **kwargs):
+        """Scheduled by set_trv_setpoint to set a single TRV when writes are paced."""
+        self.call_service("climate/set_temperature",
+                        entity_id=kwargs["entity_id"],
+                        temperature=kwargs["temperature"])
 
     @log_call
-    def verify_trv_setpoint(self, **kwargs):
+    async def verify_trv_setpoint(self, **kwargs):
+        # Runs on the event loop while the listener is suspended; the worker-thread callbacks
+        # skip until activate_listener(), so this is the only writer of the verify state
         all_setpoints_correct = True
         error_messages = []
 
-        for trv in self.trv_configs:
-            current_setpoint = self.get_state(trv['entity_id'], trv['attr'])
+        # Read all TRVs concurrently
+        results = await asyncio.gather(*[self.get_state(entity_id, attr) for entity_id, attr in self._trv_pairs])
+
+        for (entity_id, _), current_setpoint in zip(self._trv_pairs, results):
             try:
                 current_setpoint = float(current_setpoint)
             except (ValueError, TypeError):
-                self.log(f"[ERROR] Failed to read current TRV setpoint for {trv['entity_id']}")
+                self.log("[ERROR] Failed to read current TRV setpoint for %s", entity_id)
                 all_setpoints_correct = False
-                error_messages.append(f"Failed to read {trv['entity_id']}")
+                error_messages.append(f"Failed to read {entity_id}")
                 continue
 
             if abs(current_setpoint - self.expected_setpoint) >= 0.1:
                 all_setpoints_correct = False
-                error_messages.append(f"{trv['entity_id']}: Expected {self.expected_setpoint}C, got {current_setpoint}C")
+                error_messages.append(f"{entity_id}: Expected {self.expected_setpoint}C, got {current_setpoint}C")
 
         if all_setpoints_correct:
-            self.log(f"[OK] All TRVs accepted setpoint: {self.expected_setpoint}C")
+            self.log("[OK] All TRVs accepted setpoint: %sC", self.expected_setpoint)
+            self._last_trv_setpoint = self.expected_setpoint
             self.activate_listener()
         else:
             self.retry_count += 1
-            if self.retry_count < self.max_retries:
-                self.log(f"[INFO] Retry {self.retry_count}: " + "; ".join(error_messages))
-                self.run_in(self.verify_trv_setpoint, 8)
+            if self.retry_count < self.cfg.max_retries:
+                delay = min(VERIFY_DELAY_SEC * 2 ** self.retry_count, VERIFY_DELAY_MAX_SEC)
+                self.log("[INFO] Retry %s in %ss: %s", self.retry_count, delay, "; ".join(error_messages))
+                await self.run_in(self.verify_trv_setpoint, delay)
             else:
-                self.log(f"[ERROR] Max retries reached. Failed to set some TRVs to {self.expected_setpoint}C.", level="ERROR")
-                self.send_ha_notification(error_messages)
+                self.log("[ERROR] Max retries reached. Failed to set some TRVs to %sC.", self.expected_setpoint, level="ERROR")
+                await self.send_ha_notification(error_messages)
                 self.activate_listener()
 
-    def send_ha_notification(self, error_messages):
-        """Sends a notification to Home Assistant about the failure."""
-        title = f"Heat Control Alert: {self.location}"
-        message = (f"Failed to set TRV setpoint to {self.expected_setpoint}°C after {self.max_retries} retries.\n"
+    async def send_ha_notification(self, error_messages):
+        """Sends a notification to Home Assistant about the failure, unless the same one was sent recently."""
+        key = (self.cfg.location, round(self.expected_setpoint, 1))
+        now = time.monotonic()
+        if key == self._last_notify[0] and now - self._last_notify[1] < NOTIFY_DEBOUNCE_SEC:
+            return
+        self._last_notify = (key, now)
+
+        title = f"Heat Control Alert: {self.cfg.location}"
+        message = (f"Failed to set TRV setpoint to {self.expected_setpoint}°C after {self.cfg.max_retries} retries.\n"
                 f"Errors: {'; '.join(error_messages)}. Check batteries!")
-        self.call_service(self.notifier, title=title, message=message)
+        await self.call_service(self.cfg.notifier, title=title, message=message)
 
-    def get_trv_setpoint(self):
+    def get_trv_setpoint(self) -> float:
+        # Use the setpoint seen by on_trv_setpoint_change; only query HA when it is unknown
+        if self._last_trv_setpoint is not None:
+            return self._last_trv_setpoint
         # Return the setpoint of the first TRV (they should all be the same)
-        return self.get_state(self.trv_configs[0]['entity_id'], self.trv_configs[0]['attr'])
\ No newline at end of file
+        return float(self.get_state(*self._trv_pairs[0]))
\ No newline at end of file
@@ -1,5 +1,6 @@
+import asyncio
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, call, patch
 import os
 from datetime import datetime
 
@@ -8,41 +9,68 @@ from datetime import datetime
 import sys
 # Add the 'apps' directory to the path to allow imports of other apps/common libs
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from heat_ctrl import HeatControl
+from heat_ctrl import HeatControl, HeatCtrlConfig
 
 class TestHeatControl(unittest.TestCase):
 
+    # Methods that would otherwise require a running AppDaemon instance.
+    # control_trv is mocked for the on_temperature_change tests; its own tests call HeatControl.control_trv.
+    MOCKED_METHODS = ("log", "get_now", "now_is_between", "suspend_listener", "control_trv",
+                      "get_trv_setpoint", "set_trv_setpoint", "get_state", "call_service")
+
+    @classmethod
+    def setUpClass(cls):
+        """Create one HeatControl instance with mocked AppDaemon methods, shared by all tests."""
+        # We need to mock the parent ADAPI class, which is called during instantiation
+        patcher = patch('appdaemon.adapi.ADAPI.__init__', return_value=None)
+        patcher.start()
+        cls.addClassCleanup(patcher.stop)
+
+        cls.heat_control = HeatControl(None, None, None, None, None, None, None)
+        for name in cls.MOCKED_METHODS:
+            setattr(cls.heat_control, name, MagicMock())
+
     def setUp(self):
-        """Set up a mock instance of the HeatControl app for testing."""
-        # We need to mock the parent ADAPI class and its methods
-        # that are called during instantiation or in the method we're testing.
-        with patch('appdaemon.adapi.ADAPI.__init__') as mock_adapi_init:
-            mock_adapi_init.return_value = None
-            self.heat_control = HeatControl(None, None, None, None, None, None, None)
-            # Mock the logger to prevent errors and allow inspection
-            self.heat_control.log = MagicMock()
-            # Mock methods that would otherwise require a running AppDaemon instance
-            self.heat_control.get_now = MagicMock()
-            self.heat_control.now_is_between = MagicMock()
-            self.heat_control.suspend_listener = MagicMock()
-            self.heat_control.control_trv = MagicMock()
-            self.heat_control.get_trv_setpoint = MagicMock()
-            self.heat_control.set_trv_setpoint = MagicMock()
-            self.heat_control.get_state = MagicMock()
-
-            # Set default state for the listener
-            self.heat_control.active = True
-
-            # Provide a default empty config to prevent crashes on methods that need it
-            self.heat_control.periods = {}
-            # Define config values needed by control_trv
-            self.heat_control.setpoint_on = 24.0
-            self.heat_control.setpoint_off = 6.0
-            self.heat_control.temp_tol_min = 0.5
-            self.heat_control.temp_tol_max = 0.5
-            self.heat_control.window_sensor = None # Default to no window sensor
+        """Reset the mocks and re-seed the state of the shared HeatControl instance."""
+        for name in self.MOCKED_METHODS:
+            getattr(self.heat_control, name).reset_mock(return_value=True, side_effect=True)
+
+        # Set default state for the listener
+        self.heat_control.active = True
+        self.heat_control._today_cache = (None, None)
+        self.heat_control._last_trv_setpoint = None
+        self.heat_control._last_notify = (None, 0.0)
+
+        # Provide a default config (no periods, no window sensor) to prevent crashes on methods that need it
+        self.heat_control.args = {}
+        self.heat_control.cfg = HeatCtrlConfig(setpoint_on=24.0, setpoint_off=6.0,
+                                               temp_tol_min=0.5, temp_tol_max=0.5)
+        self.heat_control._valid_setpoints = frozenset((24.0, 6.0))
+        self.heat_control._schedule = []
+        self.heat_control._by_day = self.heat_control.build_day_index([])
 
 
+    def test_extract_config_reads_both_tolerances(self):
+        """Test that the min and max temperature tolerances are read from their own keys."""
+        self.heat_control.args = {
+            "temperature_tollerance_min": 0.3,
+            "temperature_tolerance_max": 0.8,
+            "trvs": []
+        }
+        self.heat_control.extract_config()
+        self.assertEqual(self.heat_control.cfg.temp_tol_min, 0.3)
+        self.assertEqual(self.heat_control.cfg.temp_tol_max, 0.8)
+
+    def test_extract_config_accepts_legacy_single_trv(self):
+        """Test that the legacy single 'trv' key is handled as a list of one TRV."""
+        self.heat_control.args = {
+            "trv": {"entities": {"trv": {"entity_id": "climate.trv", "attr": {"temperature": "temperature"}}}}
+        }
+        self.heat_control.extract_config()
+        self.assertEqual(self.heat_control.cfg.trv_configs, ({"entity_id": "climate.trv", "attr": "temperature"},))
+        self.assertEqual(self.heat_control._trv_pairs, (("climate.trv", "temperature"),))
+        self.assertEqual(self.heat_control._trv_entity_ids, ["climate.trv"])
+
     def test_is_day_in_range_single_day(self):
         """Test matching a single day."""
         self.assertTrue(self.heat_control.is_day_in_range("mon", "mon"))
@@ -85,10 +113,40 @@ class TestHeatControl(unittest.TestCase):
         self.assertFalse(self.heat_control.is_day_in_range("mon_fri", "baz"))
         self.heat_control.log.assert_called_with("Invalid current_day 'baz' provided.", level="WARNING")
 
+    def test_build_schedule(self):
+        """Test that periods are flattened into pre-parsed rules and invalid day ranges are skipped."""
+        schedule = self.heat_control.build_schedule({
+            "sat_tue": ["00:00:00,04:00:00,19"],
+            "foo": ["05:00:00,08:00:00,20"]
+        })
+        self.assertEqual(len(schedule), 1)
+        rule = schedule[0]
+        self.assertEqual((rule.start, rule.end, rule.setpoint), ("00:00:00", "04:00:00", 19.0))
+        self.assertEqual((rule.lower, rule.upper), (18.5, 19.5))
+        self.assertEqual((rule.start_idx, rule.end_idx), (5, 1))
+        self.assertTrue(rule.wrap)
+
+    def set_periods(self, periods):
+        """Builds the schedule and day index the same way extract_config does."""
+        self.heat_control._schedule = self.heat_control.build_schedule(periods)
+        self.heat_control._by_day = self.heat_control.build_day_index(self.heat_control._schedule)
+
+    def test_build_day_index_splits_midnight_rules(self):
+        """Test that a rule passing midnight is indexed as two windows on the same day."""
+        by_day = self.heat_control.build_day_index(self.heat_control.build_schedule({
+            "mon": ["22:00:00,02:00:00,19", "06:00:00,08:00:00,21"]
+        }))
+        starts, max_ends, windows, fallback = by_day[0]
+        self.assertEqual(starts, [0, 21600, 79200])
+        self.assertEqual([(w[0], w[1]) for w in windows], [(0, 7200), (21600, 28800), (79200, 86399)])
+        self.assertEqual(max_ends, [7200, 28800, 86399])
+        self.assertEqual(fallback, [])
+        self.assertEqual(by_day[1], ([], [], [], []))
+
     def test_on_temperature_change_triggers_control(self):
         """Test that on_temperature_change correctly triggers TRV control when in a scheduled period."""
         # 1. Setup: Configure the mock app instance
-        self.heat_control.periods = {
+        self.set_periods({
             "mon": [
                 "05:00:00,08:00:00,19"
             ],
@@ -96,36 +154,44 @@ class TestHeatControl(unittest.TestCase):
                 "09:00:00,13:00:00,19",
                 "14:00:00,20:00:00,20.5" # This is the period we'll match
             ]
-        }
+        })
         # Simulate being on a Wednesday at 3 PM
         self.heat_control.get_now.return_value = datetime(2024, 1, 17, 15, 0, 0) # A Wednesday
-        # Make the mock return False for the first period and True for the second,
-        # to ensure we test the correct logic branch.
-        self.heat_control.now_is_between.side_effect = [False, True]
-
         # 2. Action: Call the method with a new temperature
         new_temp = "18.5"
         self.heat_control.on_temperature_change("sensor.temp", "state", "19.0", new_temp)
 
         # 3. Assertions: Verify the correct methods were called
-        self.heat_control.now_is_between.assert_any_call("14:00:00", "20:00:00")
         self.heat_control.suspend_listener.assert_called_once()
         # Check that control_trv was called with the correct setpoint and the new temperature
-        self.heat_control.control_trv.assert_called_once_with("20.5", new_temp)
+        self.heat_control.control_trv.assert_called_once_with(20.5, new_temp, 20.0, 21.0)
+
+    def test_on_temperature_change_falls_back_to_now_is_between(self):
+        """Test that rules with non clock times, like sunrise, are matched through now_is_between."""
+        self.set_periods({
+            "mon": [
+                "09:00:00,17:00:00,21",
+                "sunrise,08:00:00,20"
+            ]
+        })
+        self.heat_control.get_now.return_value = datetime(2024, 1, 15, 7, 30, 0) # A Monday
+        self.heat_control.now_is_between.return_value = True
+
+        self.heat_control.on_temperature_change("sensor.temp", "state", "19.0", "18.5")
+
+        self.heat_control.now_is_between.assert_called_once_with("sunrise", "08:00:00")
+        self.heat_control.control_trv.assert_called_once_with(20.0, "18.5", 19.5, 20.5)
 
     def test_on_temperature_change_outside_scheduled_period(self):
         """Test that no action is taken when the temperature changes outside a scheduled period."""
         # 1. Setup: Configure the mock app instance
-        self.heat_control.periods = {
+        self.set_periods({
             "mon": [
                 "09:00:00,17:00:00,21"
             ]
-        }
+        })
         # Simulate being on a Monday at 6 PM, which is outside the schedule
         self.heat_control.get_now.return_value = datetime(2024, 1, 15, 18, 0, 0) # A Monday
-        # Ensure now_is_between returns False, as we are outside the time window
-        self.heat_control.now_is_between.return_value = False
-
         # 2. Action: Call the method with a new temperature
         new_temp = "18.5"
         self.heat_control.on_temperature_change("sensor.temp", "state", "19.0", new_temp)
@@ -134,53 +200,149 @@ class TestHeatControl(unittest.TestCase):
         self.heat_control.suspend_listener.assert_not_called()
         self.heat_control.control_trv.assert_not_called()
 
+    def test_on_temperature_change_ignores_unchanged_value(self):
+        """Test that an update with an unchanged temperature skips the schedule scan."""
+        self.heat_control.on_temperature_change("sensor.temp", "state", "19.0", "19.0")
+
+        self.heat_control.get_now.assert_not_called()
+        self.heat_control.control_trv.assert_not_called()
+
     def test_control_trv_turns_heat_on(self):
         """Test that control_trv turns the heat on when the temperature is too low."""
         # 1. Setup
         target_temp = "20.0"
         current_temp = "19.4" # Below the lower bound of 19.5
-        self.heat_control.get_trv_setpoint.return_value = str(self.heat_control.setpoint_off)
+        self.heat_control.get_trv_setpoint.return_value = self.heat_control.cfg.setpoint_off
 
         # 2. Action
-        self.heat_control.control_trv(target_temp, current_temp)
+        HeatControl.control_trv(self.heat_control, target_temp, current_temp)
 
         # 3. Assertion
-        self.heat_control.set_trv_setpoint.assert_called_once_with(self.heat_control.setpoint_on)
+        self.heat_control.set_trv_setpoint.assert_called_once_with(self.heat_control.cfg.setpoint_on)
 
     def test_control_trv_turns_heat_off(self):
         """Test that control_trv turns the heat off when the temperature is too high."""
         # 1. Setup
         target_temp = "20.0"
         current_temp = "20.6" # Above the upper bound of 20.5
-        self.heat_control.get_trv_setpoint.return_value = str(self.heat_control.setpoint_on)
+        self.heat_control.get_trv_setpoint.return_value = self.heat_control.cfg.setpoint_on
 
         # 2. Action
-        self.heat_control.control_trv(target_temp, current_temp)
+        HeatControl.control_trv(self.heat_control, target_temp, current_temp)
 
         # 3. Assertion
-        self.heat_control.set_trv_setpoint.assert_called_once_with(self.heat_control.setpoint_off)
+        self.heat_control.set_trv_setpoint.assert_called_once_with(self.heat_control.cfg.setpoint_off)
 
     def test_control_trv_does_nothing_within_tolerance(self):
         """Test that control_trv takes no action when the temperature is within the tolerance band."""
         # 1. Setup
         target_temp = "20.0"
         current_temp = "20.2" # Within the 19.5-20.5 tolerance band
-        self.heat_control.get_trv_setpoint.return_value = str(self.heat_control.setpoint_on)
+        self.heat_control.get_trv_setpoint.return_value = self.heat_control.cfg.setpoint_on
 
         # 2. Action
-        self.heat_control.control_trv(target_temp, current_temp)
+        HeatControl.control_trv(self.heat_control, target_temp, current_temp)
 
         # 3. Assertion
         self.heat_control.set_trv_setpoint.assert_not_called()
 
     def test_control_trv_turns_off_when_window_is_open(self):
         """Test that control_trv turns the heat off if the window sensor is 'on'."""
-        self.heat_control.window_sensor = "binary_sensor.window"
+        self.heat_control.cfg.window_sensor = "binary_sensor.window"
         self.heat_control.get_state.return_value = "on"
         # Simulate that the TRV is currently ON, so it needs to be turned OFF.
-        self.heat_control.get_trv_setpoint.return_value = str(self.heat_control.setpoint_on)
-        self.heat_control.control_trv("20.0", "19.0") # Temp is low, but window is open
-        self.heat_control.set_trv_setpoint.assert_called_once_with(self.heat_control.setpoint_off)
+        self.heat_control.get_trv_setpoint.return_value = self.heat_control.cfg.setpoint_on
+        HeatControl.control_trv(self.heat_control, "20.0", "19.0") # Temp is low, but window is open
+        self.heat_control.set_trv_setpoint.assert_called_once_with(self.heat_control.cfg.setpoint_off)
+
+    def set_trvs(self, *entity_ids):
+        """Configures the TRVs the way extract_config does."""
+        self.heat_control._trv_pairs = tuple((entity_id, "temperature") for entity_id in entity_ids)
+        self.heat_control._trv_entity_ids = list(entity_ids)
+
+    def test_set_trv_setpoint_paces_writes(self):
+        """Test that paced writes are staggered and the verification is pushed back accordingly."""
+        self.set_trvs("climate.trv1", "climate.trv2", "climate.trv3")
+        self.heat_control.cfg.trv_pacing = 2.0
+        self.heat_control.active = False # set_trv_setpoint only writes while the listener is suspended
+
+        with patch.object(self.heat_control, "run_in", MagicMock(), create=True) as run_in:
+            HeatControl.set_trv_setpoint(self.heat_control, 24.0)
+
+        hc = self.heat_control
+        self.assertEqual(run_in.call_args_list, [
+            call(hc._write_one_trv, 0.0, entity_id="climate.trv1", temperature=24.0),
+            call(hc._write_one_trv, 2.0, entity_id="climate.trv2", temperature=24.0),
+            call(hc._write_one_trv, 4.0, entity_id="climate.trv3", temperature=24.0),
+            call(hc.verify_trv_setpoint, 12.0), # 8s after the last write
+        ])
+        hc.call_service.assert_not_called()
+
+    def test_verify_trv_setpoint_accepts_matching_setpoints(self):
+        """Test that verification reads all TRVs concurrently and resumes the listener on success."""
+        self.set_trvs("climate.trv1", "climate.trv2")
+        self.heat_control.active = False
+        self.heat_control.expected_setpoint = 24.0
+        self.heat_control.retry_count = 0
+
+        with patch.object(self.heat_control, "get_state", AsyncMock(return_value="24.0")) as get_state, \
+             patch.object(self.heat_control, "run_in", AsyncMock(), create=True) as run_in:
+            asyncio.run(self.heat_control.verify_trv_setpoint())
+
+        self.assertEqual(get_state.await_count, 2)
+        run_in.assert_not_awaited()
+        self.assertTrue(self.heat_control.active)
+        self.assertEqual(self.heat_control._last_trv_setpoint, 24.0)
+
+    def test_verify_trv_setpoint_backs_off_exponentially(self):
+        """Test that failed verifications are retried after 16, 32 and then at most 60 seconds."""
+        self.set_trvs("climate.trv1")
+        self.heat_control.cfg.max_retries = 5
+        self.heat_control.active = False
+        self.heat_control.expected_setpoint = 24.0
+        self.heat_control.retry_count = 0
+
+        with patch.object(self.heat_control, "get_state", AsyncMock(return_value="6.0")), \
+             patch.object(self.heat_control, "run_in", AsyncMock(), create=True) as run_in:
+            for _ in range(3):
+                asyncio.run(self.heat_control.verify_trv_setpoint())
+
+        self.assertEqual([c.args[1] for c in run_in.await_args_list], [16, 32, 60])
+        self.assertFalse(self.heat_control.active)
+        self.heat_control.call_service.assert_not_called()
+
+    def test_verify_trv_setpoint_notifies_after_max_retries(self):
+        """Test that reaching max_retries sends a notification and resumes the listener."""
+        self.set_trvs("climate.trv1")
+        self.heat_control.cfg.max_retries = 2
+        self.heat_control.active = False
+        self.heat_control.expected_setpoint = 24.0
+        self.heat_control.retry_count = 1
+
+        with patch.object(self.heat_control, "get_state", AsyncMock(return_value="unavailable")), \
+             patch.object(self.heat_control, "run_in", AsyncMock(), create=True) as run_in, \
+             patch.object(self.heat_control, "call_service", AsyncMock()) as call_service:
+            asyncio.run(self.heat_control.verify_trv_setpoint())
+
+        run_in.assert_not_awaited()
+        call_service.assert_awaited_once()
+        self.assertIn("Failed to read climate.trv1", call_service.await_args.kwargs["message"])
+        self.assertTrue(self.heat_control.active)
+        self.assertIsNone(self.heat_control._last_trv_setpoint)
+
+    def test_send_ha_notification_debounces_repeated_failures(self):
+        """Test that a repeated failure notification for the same setpoint is suppressed."""
+        self.heat_control.expected_setpoint = 24.0
+
+        with patch.object(self.heat_control, "call_service", AsyncMock()) as call_service:
+            asyncio.run(self.heat_control.send_ha_notification(["climate.trv: Expected 24.0C, got 6.0C"]))
+            asyncio.run(self.heat_control.send_ha_notification(["climate.trv: Expected 24.0C, got 6.0C"]))
+            self.assertEqual(call_service.await_count, 1)
+
+            # A different setpoint is a new failure and is notified
+            self.heat_control.expected_setpoint = 6.0
+            asyncio.run(self.heat_control.send_ha_notification(["climate.trv: Expected 6.0C, got 24.0C"]))
+            self.assertEqual(call_service.await_count, 2)
 
 if __name__ == '__main__':
     unittest.main()
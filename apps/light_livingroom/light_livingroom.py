@@ -25,9 +25,8 @@ class LivingroomLight(Hass):
         self.log(f"Button press event: {data}")
         command = data.get("command")
         self.log(f"Turning livingroom lights {command}")
+        # One service call for all bulbs
         if command == "on":           
-            for bulb in self.bulbs:
-                self.turn_on(bulb)
+            self.call_service("light/turn_on", entity_id=self.bulbs)
         elif command == "off":
-            for bulb in self.bulbs:
-                self.turn_off(bulb)
+            self.call_service("light/turn_off", entity_id=self.bulbs)
@@ -1,4 +1,5 @@
 # log_bridge.py
+import logging
 from appdaemon.adapi import ADAPI
 from common.decorators import handle_errors
 
@@ -18,23 +19,39 @@ class LogBridge(ADAPI):
         self.logbook_enabled    = config.get("logbook_enabled", True)
         self.logbook_min_level  = config.get("logbook_min_level", "WARNING").upper()
         
+        # --- Level thresholds as logging ints, resolved once instead of per log record ---
+        self._logbook_level   = self.level_int(self.logbook_min_level)
+        self._min_state_level = self.level_int(self.min_level)
+
         # --- State ---
         self._is_forwarding = False # Re-entrancy guard to prevent infinite loops
 
         self.log(f"Forwarding logs of level '{self.min_level}' or higher to '{self.entity_id}'.")
         self.listen_log(self.forward_log_cb, level=self.min_level)
 
-    @handle_errors
+    @staticmethod
+    def level_int(level: str) -> int:
+        """Returns the logging module's int for a level name; unknown names count as INFO."""
+        value = logging.getLevelName(level)
+        return value if isinstance(value, int) else logging.INFO
+
+    @handle_errors()
     def forward_log_cb(self, name, ts, level, message, kwargs):
         """Callback that forwards a log entry to Home Assistant."""
         # Prevent infinite loops if this method itself causes a log entry.
         if self._is_forwarding:
             return
+
+        # Drop records below the configured level before doing any other work.
+        lvl = level.upper()
+        lvl_int = self.level_int(lvl)
+        if lvl_int < self._min_state_level:
+            return
         
         try:
             self._is_forwarding = True
             # Set state with a concise value and detailed attributes.
-            self.set_state(self.entity_id, state=level.upper(), attributes={
+            self.set_state(self.entity_id, state=lvl, attributes={
                 "friendly_name": "AppDaemon Log",
                 "message": message,
                 "app_name": name,
@@ -42,8 +59,7 @@ class LogBridge(ADAPI):
             })
 
             # Optionally send to logbook, typically for more severe levels.
-            log_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
-            if self.logbook_enabled and log_levels.index(level.upper()) >= log_levels.index(self.logbook_min_level):
+            if self.logbook_enabled and lvl_int >= self._logbook_level:
                 self.call_service("logbook/log", name=f"AppDaemon: {name}", message=message, entity_id=self.entity_id)
         finally:
             self._is_forwarding = False
\ No newline at end of file
@@ -1,12 +1,45 @@
-from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
 from appdaemon.adapi import ADAPI
-from common.decorators import log_call, handle_errors, time_it
 import re
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+# Prefer the lexbor C parser; fall back to BeautifulSoup when selectolax isn't installed
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+    from bs4 import BeautifulSoup, SoupStrainer
+    import soupsieve
+    try:
+        import lxml  # Only checked for availability
+        BS_PARSER = "lxml"
+    except ImportError:
+        BS_PARSER = "html.parser"
 
-NOTIFICATION_COOLDOWN = timedelta(days=1)
+# A single compound selector like "span.price" or "#price", which a SoupStrainer can pre-filter on
+SIMPLE_SELECTOR = re.compile(r"^([A-Za-z][\w-]*)?(?:([.#])([\w-]+))?(?:[.#][\w-]+)*$")
+
+
+NOTIFICATION_COOLDOWN_SECONDS = 86400.0 # One day
+
+# Price cleanup in one pass. Davidsen.dk uses '.' as thousands and ',' as decimal separator
+_PRICE_TRANS = str.maketrans({".": "", ",": "."})
+
+# Sent with every product request; requests decompresses gzip/deflate bodies transparently
+_REQUEST_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+# Entity id sanitization
+_RE_WS = re.compile(r'\s+')
+_RE_INVALID = re.compile(r'[^a-z0-9_]')
 
 class PriceTracker(ADAPI):
     """
@@ -19,6 +52,7 @@ class PriceTracker(ADAPI):
         config = self.args    
         self.products_to_track      = config.get("products")
         self.price_selector         = config.get("price_selector")
+        self.price_regex            = config.get("price_regex") # Optional, group 1 must capture the price
         self.notifier               = config.get("notifier", "notify/notify")
         self.check_interval_hours   = config.get("check_interval_hours", 24)
 
@@ -31,14 +65,47 @@ class PriceTracker(ADAPI):
         # --- Get configuration from apps.yaml ---
         self.extract_config()
         
-        # --- State for notification cooldown ---
+        # --- Price parsing, compiled once ---
+        self._price_re = re.compile(self.price_regex, re.DOTALL) if self.price_regex else None
+
+        # --- State for notification cooldown (time.monotonic() per sensor), shared by the fetch workers ---
         self.last_notified = {}
+        self._notify_lock = threading.Lock()
+
+        # --- Last price written per sensor, to skip unchanged state writes ---
+        self._last_state: dict[str, float] = {}
+        # --- Validators (If-None-Match/If-Modified-Since) per URL for conditional requests ---
+        self._cond_headers: dict[str, dict[str, str]] = {}
+        self._executor = None
+
+        # --- Shared HTTP session, keeps connections to the shop alive between products ---
+        self.session = requests.Session()
+        self.session.headers.update(_REQUEST_HEADERS)
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20,
+                              max_retries=Retry(total=2, backoff_factor=0.3))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
         # --- Validate configuration ---
         if not self.products_to_track or not self.price_selector:
             self.log("Missing required configuration in apps.yaml ('products' list or 'price_selector'). App will not run.")
             return
 
+        # --- Validate and pre-parse each product once ---
+        self.products_to_track = self._prepare_products(self.products_to_track)
+        if not self.products_to_track:
+            self.log("No valid products in apps.yaml. App will not run.")
+            return
+
+        # --- Compile the selector once for the BeautifulSoup fallback (lexbor takes the string directly) ---
+        if LexborHTMLParser is None:
+            self._compiled_selector = soupsieve.compile(self.price_selector)
+            self._strainer = self.build_strainer(self.price_selector)
+
+        # --- Worker threads, so products are fetched in parallel ---
+        self._executor = ThreadPoolExecutor(max_workers=min(8, len(self.products_to_track)),
+                                            thread_name_prefix="price_check")
+
         # --- Schedule the price check ---
         # Run the check immediately on startup, then every X hours
         self.run_every(
@@ -47,77 +114,98 @@ class PriceTracker(ADAPI):
             self.check_interval_hours * 3600
         )
         self.log(f"Scheduled to check price every {self.check_interval_hours} hours.")
-        self.check_all_prices() # Run once at startup
+
+    def terminate(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
 
     def check_all_prices(self, kwargs=None):
         """
-        Iterates through the list of products and checks the price for each one.
+        Checks the price for each product in the list, fetching them in parallel.
         """
         self.log(f"--- Running scheduled price check for {len(self.products_to_track)} product(s) ---")
-        for product in self.products_to_track:
-            self.check_single_product(product)
+        # One 'last_updated' timestamp shared by all sensors updated in this sweep
+        self._sweep_ts_iso = self.datetime().isoformat()
+        list(self._executor.map(self.check_single_product, self.products_to_track))
 
     def check_single_product(self, product):
         """
         Fetches a single product page, parses it, and checks the price.
         """
-        product_url  = product.get("url")
-        target_price = float(product.get("target_price"))
-        unit         = product.get("unit")
-        product_name = product.get("friendly_name", "Unnamed Product")
-        entity_id    = f"sensor.price_{self.sanitize_entity_id(product_name)}"
-
-        if not all([product_url, target_price]):
-            self.log(f"Skipping a product due to missing 'url' or 'target_price': {product}")
-            return
+        product_url  = product["url"]
+        target_price = product["_target_price"]
+        unit         = product["_unit"]
+        product_name = product["_name"]
+        entity_id    = product["_entity_id"]
 
         try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Accept-Language": "en-US,en;q=0.9",
-            }
-
             self.log(f"Fetching '{product_name}'")
-            response = requests.get(product_url, headers=headers)
-            response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+            # Streamed and closed by the with block, so the connection goes back to the pool right after parsing
+            with self.session.get(product_url, headers=self._cond_headers.get(product_url),
+                                  stream=True, timeout=(5, 15)) as response:
+                response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
 
-            soup = BeautifulSoup(response.content, 'html.parser')
+                if response.status_code == 304:
+                    # Page unchanged since the last check, reuse the price parsed then
+                    current_price = self._last_state.get(entity_id)
+                else:
+                    # Validators are only kept for a page whose price was parsed, so a parse
+                    # failure is retried on a full fetch instead of being masked by a 304
+                    self._cond_headers.pop(product_url, None)
 
-            # Find the price element using the selector
-            price_element = soup.select_one(self.price_selector)
-            
+                    # Find the price using the regex or the selector
+                    price_text = self.find_price_text(response)
 
-            if not price_element:
-                self.log(f"Could not find the price element for '{product_name}'. The website structure may have changed or the selector is incorrect.")
-                return
+                    if price_text is None:
+                        self.log(f"Could not find the price element for '{product_name}'. The website structure may have changed or the selector is incorrect.")
+                        return
 
-            # Clean up the price string. Davidsen.dk uses ',' as a decimal separator.
-            # We replace it with '.' to convert it to a float.
-            price_text = price_element.get_text(strip=True).replace(".", "").replace(",", ".")
+                    # Clean up the price string. Davidsen.dk uses ',' as a decimal separator.
+                    # We replace it with '.' to convert it to a float.
+                    price_text = price_text.translate(_PRICE_TRANS)
+
+                    current_price = float(price_text) # Convert to float for comparison
+
+                    validators = {"If-None-Match": response.headers.get("ETag"),
+                                  "If-Modified-Since": response.headers.get("Last-Modified")}
+                    self._cond_headers[product_url] = {k: v for k, v in validators.items() if v}
+
+            if current_price is None:
+                # Not modified, but no cached price to reuse; fetch the full page
+                self._cond_headers.pop(product_url, None)
+                return self.check_single_product(product)
 
-            current_price = float(price_text) # Convert to float for comparison
             self.log(f"{product_name} | {current_price=:.2f} {unit} | {target_price=} {unit}")
             
-            # Create/update the Home Assistant sensor
-            self.set_state(entity_id, state=current_price, attributes={
-                "friendly_name": product_name,
-                "unit_of_measurement": unit,
-                "target_price": target_price,
-                "url": product_url,
-                "last_updated": self.datetime().isoformat()
-            })
+            # Create/update the Home Assistant sensor, only when the price has changed or the
+            # sensor is gone (states set by AppDaemon don't survive a Home Assistant restart)
+            prev_price = self._last_state.get(entity_id)
+            if (prev_price is None or abs(prev_price - current_price) >= 1e-9
+                    or not self.entity_exists(entity_id)):
+                self.set_state(entity_id, state=current_price, attributes={
+                    "friendly_name": product_name,
+                    "unit_of_measurement": unit,
+                    "target_price": target_price,
+                    "url": product_url,
+                    "last_updated": self._sweep_ts_iso
+                })
+                self._last_state[entity_id] = current_price
 
             # Check if the price is below the target
-            now = self.datetime()
-            last_notified_time = self.last_notified.get(entity_id)
+            now = time.monotonic()
+            with self._notify_lock:
+                last_notified_time = self.last_notified.get(entity_id)
+                notify = current_price < target_price and (last_notified_time is None or now - last_notified_time > NOTIFICATION_COOLDOWN_SECONDS)
+                if notify:
+                    self.last_notified[entity_id] = now # Update notification timestamp
+                elif current_price >= target_price:
+                    # Reset notification status if price goes back up
+                    self.last_notified.pop(entity_id, None)
 
-            if current_price < target_price and (not last_notified_time or now - last_notified_time > NOTIFICATION_COOLDOWN):
+            if notify:
                 self.log(f"Price for '{product_name}' is below target! Sending notification...")
                 self.send_ha_notification(product_name, current_price, unit, target_price, product_url)
-                self.last_notified[entity_id] = now # Update notification timestamp
-            elif current_price >= target_price:
-                # Reset notification status if price goes back up
-                self.last_notified.pop(entity_id, None)
 
 
         except requests.exceptions.RequestException as e:
@@ -127,11 +215,64 @@ class PriceTracker(ADAPI):
         except Exception as e:
             self.log(f"An unexpected error occurred while checking '{product_name}': {e}")
 
+    def _prepare_products(self, products: list[dict]) -> list[dict]:
+        """
+        Returns copies of the configured products with the fields check_single_product needs precomputed
+        (self.args is left untouched). Products with a missing or invalid 'url' or 'target_price' are dropped.
+        """
+        prepared = []
+        for product in products:
+            try:
+                target_price = float(product.get("target_price"))
+            except (TypeError, ValueError):
+                target_price = None
+            if not all([product.get("url"), target_price]):
+                self.log(f"Skipping a product due to missing 'url' or 'target_price': {product}", level="WARNING")
+                continue
+
+            name = product.get("friendly_name", "Unnamed Product")
+            prepared.append(dict(product,
+                                 _target_price=target_price,
+                                 _unit=product.get("unit"),
+                                 _name=name,
+                                 _entity_id=f"sensor.price_{self.sanitize_entity_id(name)}"))
+        return prepared
+
+    def find_price_text(self, response) -> str | None:
+        """
+        Returns the price text of a product page, or None if not found.
+        Tries price_regex on the raw text first when configured, then the first element matching price_selector.
+        """
+        if self._price_re is not None:
+            match = self._price_re.search(response.text)
+            if match:
+                return match.group(1).strip()
+
+        content = response.content
+        if LexborHTMLParser is not None:
+            price_element = LexborHTMLParser(content).css_first(self.price_selector)
+            return price_element.text(strip=True) if price_element is not None else None
+
+        soup = BeautifulSoup(content, BS_PARSER, parse_only=self._strainer)
+        price_element = self._compiled_selector.select_one(soup)
+        return price_element.get_text(strip=True) if price_element is not None else None
+
+    def build_strainer(self, selector: str):
+        """
+        Returns a SoupStrainer keeping only elements that can match a single compound selector,
+        so BeautifulSoup skips building the rest of the page. Returns None (full parse) for other selectors.
+        """
+        match = SIMPLE_SELECTOR.match(selector.strip())
+        if not match or not any(match.groups()):
+            return None
+        tag, kind, value = match.groups()
+        attrs = {"class" if kind == "." else "id": value} if kind else {}
+        return SoupStrainer(tag, attrs)
+
     def sanitize_entity_id(self, name: str) -> str:
         """Converts a friendly name to a Home Assistant entity ID-safe string."""
-        name = name.lower()
-        name = re.sub(r'\s+', '_', name)       # Replace spaces with underscores
-        return re.sub(r'[^a-z0-9_]', '', name) # Remove invalid characters
+        # Replace spaces with underscores, then remove invalid characters
+        return _RE_INVALID.sub('', _RE_WS.sub('_', name.lower()))
 
     def send_ha_notification(self, name, price, unit, target_price, url):
         """